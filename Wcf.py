@@ -6,12 +6,109 @@ Generates rolling cash flow forecasts with scenario planning and sensitivity ana
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
+import threading
+import matplotlib
+matplotlib.use('Agg')  # Charts are only saved to file; no display needed
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
-from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-from openpyxl.utils.dataframe import dataframe_to_rows
-from openpyxl.chart import LineChart, Reference
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional; run the kernel as plain Python
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+# Categories treated as weekly operating expenses
+OPEX_CATS = frozenset([
+    'Marketing', 'Software', 'Rent', 'Utilities',
+    'Professional Services', 'Supplies', 'Travel'
+])
+
+# Forecast horizon and model constants
+FORECAST_WEEKS = 13
+COGS_RATE = 0.35  # 35% COGS margin
+
+# Scenario multipliers applied to revenue, collections and expenses
+SCENARIO_ADJUSTMENTS = {
+    'best': {'revenue': 1.15, 'collections': 1.10, 'expenses': 0.95},
+    'base': {'revenue': 1.00, 'collections': 1.00, 'expenses': 1.00},
+    'worst': {'revenue': 0.85, 'collections': 0.90, 'expenses': 1.05}
+}
+
+# Maximum number of (start_date, opening_balance, scenario) forecasts kept in memory
+_FORECAST_CACHE_SIZE = 32
+
+# Numeric forecast columns produced by _forecast_kernel, in order
+_KERNEL_COLUMNS = (
+    'opening_balance', 'revenue', 'ar_collections', 'total_inflows',
+    'cogs', 'payroll', 'operating_expenses', 'total_outflows',
+    'net_cash_flow', 'ending_balance'
+)
+
+
+# The explicit signature compiles the kernel (or loads it from the on-disk
+# cache) at import time instead of on the first forecast
+@njit('float64[:, :, ::1](float64[::1], boolean[::1], float64, float64, '
+      'float64, float64[::1], float64[:, ::1])', cache=True, nogil=True)
+def _forecast_kernel(base_revenue, payroll_mask, avg_payroll, avg_opex,
+                     opening_balance, collection_rates, adjustments):
+    """
+    Weekly cash flow arithmetic for several scenarios at once
+    
+    adjustments: (n_scenarios, 3) revenue/collections/expenses multipliers
+    Returns an (n_scenarios, len(_KERNEL_COLUMNS), n_weeks) array so each
+    output column is a contiguous block
+    """
+    n_scenarios = adjustments.shape[0]
+    n_weeks = base_revenue.shape[0]
+    n_lags = collection_rates.shape[0]
+    
+    # Collections on unadjusted revenue are shared by every scenario
+    collections = np.zeros(n_weeks)
+    for i in range(n_weeks):
+        for lag in range(min(i + 1, n_lags)):
+            collections[i] += base_revenue[i - lag] * collection_rates[lag]
+    
+    out = np.empty((n_scenarios, len(_KERNEL_COLUMNS), n_weeks))
+    for s in range(n_scenarios):
+        adj_revenue = adjustments[s, 0]
+        adj_collections = adjustments[s, 1]
+        adj_expenses = adjustments[s, 2]
+        balance = opening_balance
+        
+        for i in range(n_weeks):
+            # Inflows
+            revenue = base_revenue[i] * adj_revenue
+            ar_collections = collections[i] * adj_collections
+            total_inflows = revenue + ar_collections
+            
+            # Outflows
+            cogs = revenue * COGS_RATE
+            payroll = avg_payroll * adj_expenses if payroll_mask[i] else 0.0
+            operating_expenses = avg_opex * adj_expenses
+            total_outflows = cogs + payroll + operating_expenses
+            
+            # Net cash flow
+            net_cash_flow = total_inflows - total_outflows
+            ending_balance = balance + net_cash_flow
+            
+            out[s, 0, i] = balance
+            out[s, 1, i] = revenue
+            out[s, 2, i] = ar_collections
+            out[s, 3, i] = total_inflows
+            out[s, 4, i] = cogs
+            out[s, 5, i] = payroll
+            out[s, 6, i] = operating_expenses
+            out[s, 7, i] = total_outflows
+            out[s, 8, i] = net_cash_flow
+            out[s, 9, i] = ending_balance
+            
+            balance = ending_balance
+    
+    return out
+
 
 class CashFlowForecaster:
     """Generate 13-week cash flow forecasts with scenario analysis"""
@@ -26,10 +123,47 @@ class CashFlowForecaster:
         self.historical = historical_data.copy()
         self.historical['date'] = pd.to_datetime(self.historical['date'])
         self.historical['week'] = self.historical['date'].dt.to_period('W')
+        # Categorical codes make the category filters integer comparisons
+        self.historical['category'] = self.historical['category'].astype('category')
+        
+        # Precompute revenue lookups so _forecast_revenue avoids rescanning history
+        revenue = self.historical[self.historical['category'] == 'Revenue']
+        # Grouping on the nullable week drops rows with a missing date
+        week_of_year = revenue['date'].dt.isocalendar().week
+        self._rev_by_woy = {
+            int(week): amount
+            for week, amount in revenue.groupby(week_of_year)['amount'].mean().dropna().items()
+        }
+        self._rev_fallback = revenue['amount'].mean() / 4  # Convert monthly to weekly
+        self._hist_min_date = self.historical['date'].min()
+        
+        # Expense baselines are invariant across forecast weeks and scenarios
+        avg_payroll = self.historical[
+            self.historical['category'] == 'Payroll'
+        ]['amount'].mean()
+        self._avg_payroll = avg_payroll if not pd.isna(avg_payroll) else 50000
+        
+        categories = self.historical['category'].cat.categories
+        opex_codes = [categories.get_loc(c) for c in OPEX_CATS if c in categories]
+        weekly_opex = self.historical[
+            self.historical['category'].cat.codes.isin(opex_codes)
+        ].groupby('week', sort=False)['amount'].sum().mean()
+        self._avg_weekly_opex = weekly_opex if not pd.isna(weekly_opex) else 15000
         
         # Calculate collection patterns from historical data
         self.collection_patterns = self._calculate_collection_patterns()
         self.payment_patterns = self._calculate_payment_patterns()
+        self._collection_rates = np.array([
+            self.collection_patterns['current'],
+            self.collection_patterns['week_1'],
+            self.collection_patterns['week_2'],
+            self.collection_patterns['week_3'],
+            self.collection_patterns['week_4']
+        ])
+        
+        # Forecasts keyed by (start_date, opening_balance, scenario)
+        self._forecast_cache = {}
+        self._forecast_cache_lock = threading.Lock()
         
     def _calculate_collection_patterns(self):
         """Analyze historical AR collection patterns"""
@@ -68,142 +202,121 @@ class CashFlowForecaster:
         
         scenario: 'base', 'best', 'worst'
         """
-        weeks = pd.date_range(start=start_date, periods=13, freq='W-MON')
-        forecast = []
-        
-        # Scenario adjustments
-        scenario_adjustments = {
-            'best': {'revenue': 1.15, 'collections': 1.10, 'expenses': 0.95},
-            'base': {'revenue': 1.00, 'collections': 1.00, 'expenses': 1.00},
-            'worst': {'revenue': 0.85, 'collections': 0.90, 'expenses': 1.05}
-        }
-        
-        adj = scenario_adjustments[scenario]
-        current_balance = opening_balance
-        
-        for i, week_start in enumerate(weeks):
-            week_end = week_start + timedelta(days=6)
+        return self._forecast_scenarios(start_date, opening_balance, [scenario])[scenario]
+    
+    def _forecast_scenarios(self, start_date, opening_balance, scenarios):
+        """Run the forecast kernel once for the requested scenarios not yet cached"""
+        start_date = pd.Timestamp(start_date)
+        forecasts = {}
+        missing = []
+        with self._forecast_cache_lock:
+            for scenario in scenarios:
+                cached = self._forecast_cache.get((start_date, opening_balance, scenario))
+                if cached is None:
+                    missing.append(scenario)
+                else:
+                    forecasts[scenario] = cached
+        
+        if missing:
+            weeks = pd.date_range(start=start_date, periods=FORECAST_WEEKS, freq='W-MON')
             
-            # Calculate weekly metrics
-            revenue = self._forecast_revenue(week_start) * adj['revenue']
-            ar_collections = self._forecast_ar_collections(week_start, i) * adj['collections']
-            total_inflows = revenue + ar_collections
+            week_of_year = weeks.isocalendar().week.to_numpy()
             
-            # Outflows
-            cogs = revenue * 0.35  # 35% COGS margin
-            payroll = self._forecast_payroll(week_start) * adj['expenses']
-            operating_expenses = self._forecast_opex(week_start) * adj['expenses']
-            total_outflows = cogs + payroll + operating_expenses
+            base_revenue = self._forecast_revenue_weeks(weeks, week_of_year)
+            payroll_mask = week_of_year % 2 == 0  # Bi-weekly payroll
+            adjustments = np.array([
+                [SCENARIO_ADJUSTMENTS[s]['revenue'],
+                 SCENARIO_ADJUSTMENTS[s]['collections'],
+                 SCENARIO_ADJUSTMENTS[s]['expenses']]
+                for s in missing
+            ])
             
-            # Net cash flow
-            net_cash_flow = total_inflows - total_outflows
-            ending_balance = current_balance + net_cash_flow
+            values = _forecast_kernel(
+                base_revenue, payroll_mask,
+                float(self._avg_payroll), float(self._avg_weekly_opex),
+                float(opening_balance), self._collection_rates, adjustments
+            )
             
-            forecast.append({
-                'week_number': i + 1,
-                'week_start': week_start,
-                'week_end': week_end,
-                'opening_balance': current_balance,
-                'revenue': revenue,
-                'ar_collections': ar_collections,
-                'total_inflows': total_inflows,
-                'cogs': cogs,
-                'payroll': payroll,
-                'operating_expenses': operating_expenses,
-                'total_outflows': total_outflows,
-                'net_cash_flow': net_cash_flow,
-                'ending_balance': ending_balance,
-                'scenario': scenario
-            })
+            week_numbers = np.arange(1, len(weeks) + 1)
+            week_ends = weeks + timedelta(days=6)
+            for s, scenario in enumerate(missing):
+                # The cached frame wraps the kernel output directly; callers
+                # still receive their own copy below
+                forecasts[scenario] = pd.DataFrame({
+                    'week_number': week_numbers,
+                    'week_start': weeks,
+                    'week_end': week_ends,
+                    **dict(zip(_KERNEL_COLUMNS, values[s])),
+                    'scenario': scenario
+                }, copy=False)
             
-            current_balance = ending_balance
-        
-        return pd.DataFrame(forecast)
+            with self._forecast_cache_lock:
+                for scenario in missing:
+                    self._forecast_cache[(start_date, opening_balance, scenario)] = forecasts[scenario]
+                
+                # Evict the oldest entries
+                while len(self._forecast_cache) > _FORECAST_CACHE_SIZE:
+                    del self._forecast_cache[next(iter(self._forecast_cache))]
+        
+        # Return copies so callers can modify them without touching the cache
+        return {scenario: forecasts[scenario].copy() for scenario in scenarios}
     
     def _forecast_revenue(self, week_start):
         """Forecast weekly revenue based on historical patterns"""
-        # Get historical average for same week of year
         week_of_year = week_start.isocalendar()[1]
-        historical_revenue = self.historical[
-            (self.historical['category'] == 'Revenue') &
-            (self.historical['date'].dt.isocalendar().week == week_of_year)
-        ]['amount'].mean()
-        
+        return self._forecast_revenue_weeks(pd.DatetimeIndex([week_start]), [week_of_year])[0]
+    
+    def _forecast_revenue_weeks(self, weeks, week_of_year):
+        """Forecast revenue for a range of weeks in one pass"""
+        # Get historical average for same week of year
         # If no historical data, use overall average with growth
-        if pd.isna(historical_revenue):
-            historical_revenue = self.historical[
-                self.historical['category'] == 'Revenue'
-            ]['amount'].mean() / 4  # Convert monthly to weekly
+        historical_revenue = np.array([
+            self._rev_by_woy.get(woy, self._rev_fallback) for woy in week_of_year
+        ])
         
         # Apply 5% growth trend
-        weeks_from_start = (week_start - self.historical['date'].min()).days / 7
+        weeks_from_start = (weeks - self._hist_min_date).days.to_numpy() / 7
         growth_factor = 1 + (0.05 * weeks_from_start / 52)
         
         return historical_revenue * growth_factor
     
     def _forecast_ar_collections(self, week_start, week_index):
-        """Forecast AR collections based on revenue and collection patterns"""
+        """Forecast AR collections for a single week (generate_forecast uses a convolution)"""
         # Look back at revenue from previous weeks and apply collection pattern
-        collections = 0
-        
-        for lag_weeks, rate in [
-            (0, self.collection_patterns['current']),
-            (1, self.collection_patterns['week_1']),
-            (2, self.collection_patterns['week_2']),
-            (3, self.collection_patterns['week_3']),
-            (4, self.collection_patterns['week_4'])
-        ]:
-            if week_index >= lag_weeks:
-                past_week = week_start - timedelta(weeks=lag_weeks)
-                past_revenue = self._forecast_revenue(past_week)
-                collections += past_revenue * rate
-        
-        return collections
+        rates = self._collection_rates[:week_index + 1]
+        past_revenue = np.array([
+            self._forecast_revenue(week_start - timedelta(weeks=lag_weeks))
+            for lag_weeks in range(len(rates))
+        ])
+        return past_revenue @ rates
     
     def _forecast_payroll(self, week_start):
         """Forecast payroll (typically bi-weekly)"""
         # Bi-weekly payroll
         week_number = week_start.isocalendar()[1]
         if week_number % 2 == 0:
-            avg_payroll = self.historical[
-                self.historical['category'] == 'Payroll'
-            ]['amount'].mean()
-            return avg_payroll if not pd.isna(avg_payroll) else 50000
+            return self._avg_payroll
         return 0
     
     def _forecast_opex(self, week_start):
         """Forecast operating expenses"""
         # Weekly average of operating expenses
-        opex_categories = ['Marketing', 'Software', 'Rent', 'Utilities', 
-                          'Professional Services', 'Supplies', 'Travel']
-        
-        weekly_opex = self.historical[
-            self.historical['category'].isin(opex_categories)
-        ].groupby('week')['amount'].sum().mean()
-        
-        return weekly_opex if not pd.isna(weekly_opex) else 15000
+        return self._avg_weekly_opex
     
     def generate_scenario_comparison(self, start_date, opening_balance):
         """Generate forecasts for all three scenarios"""
-        scenarios = {}
-        
-        for scenario in ['best', 'base', 'worst']:
-            scenarios[scenario] = self.generate_forecast(
-                start_date, opening_balance, scenario
-            )
-        
-        return scenarios
+        return self._forecast_scenarios(
+            start_date, opening_balance, ['best', 'base', 'worst']
+        )
     
     def calculate_runway(self, forecast_df, burn_threshold=50000):
         """Calculate cash runway (weeks until cash below threshold)"""
-        below_threshold = forecast_df[
-            forecast_df['ending_balance'] < burn_threshold
-        ]
+        below_threshold = forecast_df['ending_balance'].to_numpy() < burn_threshold
         
-        if len(below_threshold) == 0:
-            return 13, "Beyond forecast period"
+        if not below_threshold.any():
+            return FORECAST_WEEKS, "Beyond forecast period"
         
-        first_week = below_threshold.iloc[0]['week_number']
+        first_week = int(forecast_df['week_number'].to_numpy()[below_threshold.argmax()])
         return first_week, f"Week {first_week}"
     
     def sensitivity_analysis(self, start_date, opening_balance):
@@ -215,7 +328,6 @@ class CashFlowForecaster:
         
         # Test revenue changes
         for revenue_change in [-0.20, -0.10, 0, 0.10, 0.20]:
-            forecast = self.generate_forecast(start_date, opening_balance, 'base')
             # Adjust revenue in forecast (simplified)
             adjusted_ending = base_ending * (1 + revenue_change * 1.5)
             
@@ -246,11 +358,12 @@ class CashFlowForecaster:
         fig, axes = plt.subplots(2, 2, figsize=(16, 12))
         fig.suptitle('13-Week Cash Flow Forecast & Analysis', 
                      fontsize=16, fontweight='bold')
+        thousands_formatter = plt.FuncFormatter(lambda x, p: f'${x/1000:.0f}K')
         
         # 1. Ending Balance by Scenario
         ax1 = axes[0, 0]
         for scenario, df in scenarios.items():
-            ax1.plot(df['week_number'], df['ending_balance'], 
+            ax1.plot(df['week_number'].to_numpy(), df['ending_balance'].to_numpy(), 
                     marker='o', linewidth=2, label=scenario.capitalize())
         
         ax1.axhline(y=50000, color='r', linestyle='--', alpha=0.5, label='Min. Balance')
@@ -259,18 +372,20 @@ class CashFlowForecaster:
         ax1.set_title('Cash Balance Scenarios')
         ax1.legend()
         ax1.grid(True, alpha=0.3)
-        ax1.yaxis.set_major_formatter(plt.FuncFormatter(lambda x, p: f'${x/1000:.0f}K'))
+        ax1.yaxis.set_major_formatter(thousands_formatter)
         
         # 2. Weekly Cash Flow (Base Scenario)
         ax2 = axes[0, 1]
         base_df = scenarios['base']
         
-        x = base_df['week_number']
+        x = base_df['week_number'].to_numpy()
+        revenue = base_df['revenue'].to_numpy()
+        ar_collections = base_df['ar_collections'].to_numpy()
         width = 0.35
         
-        ax2.bar(x - width/2, base_df['total_inflows'], width, 
+        ax2.bar(x - width/2, base_df['total_inflows'].to_numpy(), width, 
                label='Inflows', color='green', alpha=0.7)
-        ax2.bar(x + width/2, -base_df['total_outflows'], width,
+        ax2.bar(x + width/2, -base_df['total_outflows'].to_numpy(), width,
                label='Outflows', color='red', alpha=0.7)
         
         ax2.set_xlabel('Week Number')
@@ -278,19 +393,19 @@ class CashFlowForecaster:
         ax2.set_title('Weekly Cash Inflows vs Outflows (Base)')
         ax2.legend()
         ax2.grid(True, alpha=0.3, axis='y')
-        ax2.yaxis.set_major_formatter(plt.FuncFormatter(lambda x, p: f'${x/1000:.0f}K'))
+        ax2.yaxis.set_major_formatter(thousands_formatter)
         
         # 3. Cumulative Cash Flow
         ax3 = axes[1, 0]
-        base_df['cumulative_flow'] = base_df['net_cash_flow'].cumsum()
+        cumulative_flow = np.cumsum(base_df['net_cash_flow'].to_numpy())
         
-        ax3.fill_between(base_df['week_number'], 0, base_df['cumulative_flow'],
-                        where=base_df['cumulative_flow'] >= 0,
+        ax3.fill_between(x, 0, cumulative_flow,
+                        where=cumulative_flow >= 0,
                         color='green', alpha=0.3, label='Positive')
-        ax3.fill_between(base_df['week_number'], 0, base_df['cumulative_flow'],
-                        where=base_df['cumulative_flow'] < 0,
+        ax3.fill_between(x, 0, cumulative_flow,
+                        where=cumulative_flow < 0,
                         color='red', alpha=0.3, label='Negative')
-        ax3.plot(base_df['week_number'], base_df['cumulative_flow'],
+        ax3.plot(x, cumulative_flow,
                 color='blue', linewidth=2, marker='o')
         
         ax3.axhline(y=0, color='black', linestyle='-', linewidth=0.5)
@@ -299,17 +414,15 @@ class CashFlowForecaster:
         ax3.set_title('Cumulative Cash Flow (Base)')
         ax3.legend()
         ax3.grid(True, alpha=0.3)
-        ax3.yaxis.set_major_formatter(plt.FuncFormatter(lambda x, p: f'${x/1000:.0f}K'))
+        ax3.yaxis.set_major_formatter(thousands_formatter)
         
         # 4. Inflow Breakdown
         ax4 = axes[1, 1]
         
-        inflow_data = base_df[['week_number', 'revenue', 'ar_collections']]
-        
-        ax4.bar(inflow_data['week_number'], inflow_data['revenue'],
+        ax4.bar(x, revenue,
                label='Direct Revenue', color='lightblue', alpha=0.8)
-        ax4.bar(inflow_data['week_number'], inflow_data['ar_collections'],
-               bottom=inflow_data['revenue'],
+        ax4.bar(x, ar_collections,
+               bottom=revenue,
                label='AR Collections', color='darkblue', alpha=0.8)
         
         ax4.set_xlabel('Week Number')
@@ -317,7 +430,7 @@ class CashFlowForecaster:
         ax4.set_title('Cash Inflow Composition')
         ax4.legend()
         ax4.grid(True, alpha=0.3, axis='y')
-        ax4.yaxis.set_major_formatter(plt.FuncFormatter(lambda x, p: f'${x/1000:.0f}K'))
+        ax4.yaxis.set_major_formatter(thousands_formatter)
         
         plt.tight_layout()
         plt.savefig(save_path, dpi=300, bbox_inches='tight')
@@ -326,38 +439,45 @@ class CashFlowForecaster:
     
     def export_to_excel(self, scenarios, sensitivity_df, filename='cash_flow_forecast.xlsx'):
         """Export forecasts and analysis to Excel"""
-        wb = Workbook()
-        wb.remove(wb.active)
-        
-        # Base Case Forecast
-        ws_base = wb.create_sheet('Base Case')
-        self._write_forecast_sheet(ws_base, scenarios['base'], 'Base Case Forecast')
-        
-        # Best Case
-        ws_best = wb.create_sheet('Best Case')
-        self._write_forecast_sheet(ws_best, scenarios['best'], 'Best Case Forecast')
-        
-        # Worst Case
-        ws_worst = wb.create_sheet('Worst Case')
-        self._write_forecast_sheet(ws_worst, scenarios['worst'], 'Worst Case Forecast')
-        
-        # Scenario Comparison
-        ws_compare = wb.create_sheet('Scenario Comparison')
-        self._write_comparison_sheet(ws_compare, scenarios)
-        
-        # Sensitivity Analysis
-        ws_sensitivity = wb.create_sheet('Sensitivity Analysis')
-        self._write_sensitivity_sheet(ws_sensitivity, sensitivity_df)
+        with pd.ExcelWriter(filename, engine='xlsxwriter') as writer:
+            wb = writer.book
+            formats = {
+                'title': wb.add_format({'bold': True, 'font_size': 14}),
+                'header': wb.add_format({'bold': True, 'font_color': '#FFFFFF',
+                                         'bg_color': '#366092', 'pattern': 1}),
+                'money': wb.add_format({'num_format': '$#,##0'})
+            }
+            
+            # Base Case Forecast
+            self._write_forecast_sheet(writer, formats, 'Base Case',
+                                       scenarios['base'], 'Base Case Forecast')
+            
+            # Best Case
+            self._write_forecast_sheet(writer, formats, 'Best Case',
+                                       scenarios['best'], 'Best Case Forecast')
+            
+            # Worst Case
+            self._write_forecast_sheet(writer, formats, 'Worst Case',
+                                       scenarios['worst'], 'Worst Case Forecast')
+            
+            # Scenario Comparison
+            self._write_comparison_sheet(writer, formats, scenarios)
+            
+            # Sensitivity Analysis
+            self._write_sensitivity_sheet(writer, formats, sensitivity_df)
         
-        wb.save(filename)
         print(f"Cash flow forecast exported to {filename}")
     
-    def _write_forecast_sheet(self, ws, df, title):
+    def _write_table(self, writer, formats, sheet_name, df, title, header_format=None):
+        """Write a title in row 1 and a table from row 3, returning the worksheet"""
+        df.to_excel(writer, sheet_name=sheet_name, startrow=3, header=False, index=False)
+        ws = writer.sheets[sheet_name]
+        ws.write(0, 0, title, formats['title'])
+        ws.write_row(2, 0, df.columns, header_format)
+        return ws
+    
+    def _write_forecast_sheet(self, writer, formats, sheet_name, df, title):
         """Write forecast data to worksheet"""
-        ws.append([title])
-        ws['A1'].font = Font(bold=True, size=14)
-        ws.append([])
-        
         # Format for display
         display_df = df[[
             'week_number', 'week_start', 'opening_balance',
@@ -369,31 +489,17 @@ class CashFlowForecaster:
             'Total Inflows', 'Total Outflows', 'Net Cash Flow', 'Ending Balance'
         ]
         
-        for r in dataframe_to_rows(display_df, index=False, header=True):
-            ws.append(r)
-        
-        # Format header
-        for cell in ws[3]:
-            cell.fill = PatternFill(start_color='366092', end_color='366092', fill_type='solid')
-            cell.font = Font(color='FFFFFF', bold=True)
+        ws = self._write_table(writer, formats, sheet_name, display_df, title, formats['header'])
         
-        # Format numbers
-        for row in ws.iter_rows(min_row=4, max_row=ws.max_row):
-            for i, cell in enumerate(row):
-                if i >= 2 and isinstance(cell.value, (int, float)):
-                    cell.number_format = '$#,##0'
-        
-        # Adjust widths
-        for column in ws.columns:
-            max_length = max(len(str(cell.value)) for cell in column)
-            ws.column_dimensions[column[0].column_letter].width = min(max_length + 2, 20)
+        # Adjust widths and format numbers one column at a time
+        for i, column in enumerate(display_df.columns):
+            max_length = max(len(column), display_df[column].astype(str).str.len().max())
+            if i == 0:
+                max_length = max(max_length, len(title))
+            ws.set_column(i, i, min(max_length + 2, 20), formats['money'] if i >= 2 else None)
     
-    def _write_comparison_sheet(self, ws, scenarios):
+    def _write_comparison_sheet(self, writer, formats, scenarios):
         """Write scenario comparison"""
-        ws.append(['Scenario Comparison - Week 13 Ending Balance'])
-        ws['A1'].font = Font(bold=True, size=14)
-        ws.append([])
-        
         comparison = []
         for scenario, df in scenarios.items():
             ending = df.iloc[-1]['ending_balance']
@@ -404,93 +510,84 @@ class CashFlowForecaster:
         
         comp_df = pd.DataFrame(comparison)
         
-        for r in dataframe_to_rows(comp_df, index=False, header=True):
-            ws.append(r)
-        
-        for cell in ws[3]:
-            cell.fill = PatternFill(start_color='366092', end_color='366092', fill_type='solid')
-            cell.font = Font(color='FFFFFF', bold=True)
+        self._write_table(writer, formats, 'Scenario Comparison', comp_df,
+                          'Scenario Comparison - Week 13 Ending Balance', formats['header'])
     
-    def _write_sensitivity_sheet(self, ws, sensitivity_df):
+    def _write_sensitivity_sheet(self, writer, formats, sensitivity_df):
         """Write sensitivity analysis"""
-        ws.append(['Sensitivity Analysis'])
-        ws['A1'].font = Font(bold=True, size=14)
-        ws.append([])
-        
-        for r in dataframe_to_rows(sensitivity_df, index=False, header=True):
-            ws.append(r)
-
+        self._write_table(writer, formats, 'Sensitivity Analysis', sensitivity_df,
+                          'Sensitivity Analysis')
 
 def generate_sample_historical_data():
     """Generate sample historical cash flow data"""
-    np.random.seed(42)
+    rng = np.random.default_rng(42)
     
     # 26 weeks of historical data
-    start_date = datetime.now() - timedelta(weeks=26)
-    dates = pd.date_range(start=start_date, periods=26*7, freq='D')
+    n_weeks = 26
+    start_date = datetime.now() - timedelta(weeks=n_weeks)
+    week_index = np.arange(n_weeks)
+    week_starts = pd.date_range(start=start_date, periods=n_weeks, freq='7D')
     
-    transactions = []
+    frames = []
     
-    # Weekly revenue pattern
-    for week in range(26):
-        week_start = start_date + timedelta(weeks=week)
-        
-        # Revenue (varies by week with trend)
-        base_revenue = 80000 + np.random.normal(0, 10000)
-        growth = week * 500  # Growing trend
-        weekly_revenue = base_revenue + growth
-        
-        transactions.append({
-            'date': week_start,
-            'category': 'Revenue',
-            'amount': weekly_revenue,
+    # Revenue (varies by week with trend)
+    base_revenue = 80000 + rng.normal(0, 10000, n_weeks)
+    growth = week_index * 500  # Growing trend
+    frames.append(pd.DataFrame({
+        'date': week_starts,
+        'category': 'Revenue',
+        'amount': base_revenue + growth,
+        'payment_terms': 'Net 30'
+    }))
+    
+    # AR Collections (from past revenue)
+    collecting = week_index >= 4
+    frames.append(pd.DataFrame({
+        'date': week_starts[collecting],
+        'category': 'AR Collections',
+        'amount': base_revenue[collecting] * (0.30 +  # Current week
+                                              0.40 +  # Week 1
+                                              0.20 +  # Week 2
+                                              0.10),  # Week 3+
+        'payment_terms': 'Various'
+    }))
+    
+    # Bi-weekly payroll
+    payroll_weeks = week_index % 2 == 0
+    frames.append(pd.DataFrame({
+        'date': week_starts[payroll_weeks],
+        'category': 'Payroll',
+        'amount': 55000 + rng.normal(0, 2000, payroll_weeks.sum()),
+        'payment_terms': 'Immediate'
+    }))
+    
+    # Weekly operating expenses
+    for category, amount_range in [
+        ('Marketing', (8000, 15000)),
+        ('Software', (3000, 5000)),
+        ('Rent', (12000, 12000)),
+        ('Utilities', (2000, 3000)),
+        ('Professional Services', (5000, 10000)),
+        ('Supplies', (1000, 3000)),
+        ('Travel', (2000, 8000))
+    ]:
+        if category == 'Rent':
+            paid_weeks = week_index % 4 == 0  # Rent is monthly
+        else:
+            paid_weeks = np.ones(n_weeks, dtype=bool)
+        n_payments = paid_weeks.sum()
+        day_offsets = pd.to_timedelta(rng.integers(0, 7, n_payments), unit='D')
+        
+        frames.append(pd.DataFrame({
+            'date': week_starts[paid_weeks] + day_offsets,
+            'category': category,
+            'amount': rng.uniform(*amount_range, n_payments),
             'payment_terms': 'Net 30'
-        })
-        
-        # AR Collections (from past revenue)
-        if week >= 4:
-            collections = (base_revenue * 0.30 +  # Current week
-                          base_revenue * 0.40 +  # Week 1
-                          base_revenue * 0.20 +  # Week 2
-                          base_revenue * 0.10)   # Week 3+
-            
-            transactions.append({
-                'date': week_start,
-                'category': 'AR Collections',
-                'amount': collections,
-                'payment_terms': 'Various'
-            })
-        
-        # Bi-weekly payroll
-        if week % 2 == 0:
-            transactions.append({
-                'date': week_start,
-                'category': 'Payroll',
-                'amount': 55000 + np.random.normal(0, 2000),
-                'payment_terms': 'Immediate'
-            })
-        
-        # Weekly operating expenses
-        for category, amount_range in [
-            ('Marketing', (8000, 15000)),
-            ('Software', (3000, 5000)),
-            ('Rent', (12000, 12000)),
-            ('Utilities', (2000, 3000)),
-            ('Professional Services', (5000, 10000)),
-            ('Supplies', (1000, 3000)),
-            ('Travel', (2000, 8000))
-        ]:
-            if category == 'Rent' and week % 4 != 0:
-                continue  # Rent is monthly
-            
-            transactions.append({
-                'date': week_start + timedelta(days=np.random.randint(0, 7)),
-                'category': category,
-                'amount': np.random.uniform(*amount_range),
-                'payment_terms': 'Net 30'
-            })
+        }))
     
-    return pd.DataFrame(transactions)
+    return pd.concat(frames, ignore_index=True).sort_values(
+        'date', kind='stable', ignore_index=True
+    )
 
 
 # Main execution